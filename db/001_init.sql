@@ -1,9 +1,20 @@
+-- Serialize concurrent boots (several workers running ensureSchema at once)
+select pg_advisory_xact_lock(hashtext('solidus-telebot:schema'));
+
 create table if not exists clients (
   client_id text primary key,
   client_name text not null,
   vault_account_id text not null
 );
 
+-- Vaults per client across Fireblocks workspaces ('primary' / 'secondary')
+create table if not exists client_vaults (
+  client_id text not null references clients(client_id),
+  workspace text not null,
+  vault_account_id text not null,
+  primary key (client_id, workspace, vault_account_id)
+);
+
 create table if not exists user_links (
   telegram_user_id bigint primary key,
   client_id text not null references clients(client_id),
@@ -36,3 +47,5 @@ create table if not exists audit (
   action text not null,
   ts timestamptz not null default now()
 );
+
+create index if not exists audit_ts_idx on audit(ts);
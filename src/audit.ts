@@ -0,0 +1,48 @@
+import { preparedQuery } from './db';
+
+type AuditRow = { telegramUserId: number, clientId: string | null, action: string };
+
+// Audit rows are buffered and written as one multi-row insert (one commit)
+// every FLUSH_MS, or as soon as FLUSH_MAX rows are queued.
+const FLUSH_MAX = 500;
+const FLUSH_MS = 200;
+
+const SQL_INSERT_AUDIT_BATCH =
+  "insert into audit(telegram_user_id, client_id, action) select * from unnest($1::bigint[], $2::text[], $3::text[])";
+
+let buf: AuditRow[] = [];
+let timer: NodeJS.Timeout | null = null;
+// Tail of the write chain: each flush runs after the previous one, so
+// awaiting flushAudit() also waits for any flush already in flight
+let inflight: Promise<void> = Promise.resolve();
+
+export function audit(telegramUserId: number, clientId: string | null, action: string) {
+  buf.push({ telegramUserId, clientId, action });
+  if (buf.length >= FLUSH_MAX) void flushAudit();
+  else if (!timer) timer = setTimeout(() => void flushAudit(), FLUSH_MS);
+}
+
+export function flushAudit(): Promise<void> {
+  if (timer) {
+    clearTimeout(timer);
+    timer = null;
+  }
+  if (buf.length) {
+    const rows = buf;
+    buf = [];
+    inflight = inflight.then(() => writeRows(rows));
+  }
+  return inflight;
+}
+
+async function writeRows(rows: AuditRow[]) {
+  try {
+    await preparedQuery(
+      'audit_batch',
+      SQL_INSERT_AUDIT_BATCH,
+      [rows.map(r => r.telegramUserId), rows.map(r => r.clientId), rows.map(r => r.action)]
+    );
+  } catch (e) {
+    console.error(`Failed to write ${rows.length} audit rows`, e);
+  }
+}
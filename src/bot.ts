@@ -1,120 +1,255 @@
-import { Telegraf } from 'telegraf';
-import { query } from './db';
+import { Context, MiddlewareFn, Telegraf } from 'telegraf';
+import { createHash } from 'crypto';
+import { preparedQuery } from './db';
 import { mapAssetId } from './mapping';
 import { getCurrentPrices, getPrice24hAgo } from './prices';
-import { makeFireblocksClient } from './fireblocks';
+import { getFireblocksClient } from './fireblocks';
 import Decimal from 'decimal.js';
-import { valueHoldings } from './portfolio';
+import { Holding, valueHoldings } from './portfolio';
+import { makeTokenBucket } from './ratelimit';
+import { audit } from './audit';
 
 const BOT_TOKEN = process.env.BOT_TOKEN!;
 export const bot = new Telegraf(BOT_TOKEN);
 
+// Outbound messages are throttled below Telegram's ~30 msg/s bot-wide limit
+const sendBucket = makeTokenBucket(28);
+async function reply(ctx: Context, text: string) {
+  await sendBucket.take();
+  return ctx.reply(text);
+}
+
+// SQL for the handlers, kept as module constants and run as named prepared
+// statements so each is parsed and planned once per pooled connection
+const SQL_LINK_BY_USER = "select client_id from user_links where telegram_user_id=$1";
+
+// Name and vaults for one client in a single round trip. A client with no
+// client_vaults rows falls back to its legacy clients.vault_account_id (primary).
+const SQL_CLIENT_PROFILE =
+  `select c.client_name,
+          coalesce(cv.workspace, 'primary') as workspace,
+          coalesce(cv.vault_account_id, c.vault_account_id) as vault_account_id
+     from clients c left join client_vaults cv on cv.client_id = c.client_id
+    where c.client_id=$1`;
+
+const SQL_ASSET_MAP_ALL = "select asset_id, coingecko_id from asset_map";
+
+// Look up, consume, link and audit a link code atomically. The used_at/expires_at
+// guards on the update stop an expired code, or two concurrent /link calls,
+// from redeeming it; `code` sees the row as it was before the update.
+const SQL_REDEEM_LINK_CODE =
+  `with code as (
+     select client_id, expires_at, used_at from link_codes where code_hash=$1
+   ), used as (
+     update link_codes set used_at=now()
+      where code_hash=$1 and used_at is null and expires_at >= now()
+      returning client_id
+   ), linked as (
+     insert into user_links(telegram_user_id, client_id) select $2::bigint, client_id from used
+     on conflict (telegram_user_id) do update set client_id=excluded.client_id
+   ), audited as (
+     insert into audit(telegram_user_id, client_id, action) select $2::bigint, client_id, 'link' from used
+   )
+   select client_id, expires_at < now() as expired, used_at, exists(select 1 from used) as linked from code`;
+
+// Static replies, built once at load
+const WELCOME_TEXT = "Welcome! If you’re a Solidus client, link your account with:\n/link YOURCODE";
+const LINK_USAGE_TEXT = "Usage: /link YOURCODE";
+const INVALID_CODE_TEXT = "Invalid code.";
+const CODE_EXPIRED_TEXT = "This code expired.";
+const CODE_USED_TEXT = "This code was already used.";
+const LINKED_TEXT = "Linked! You can now use /portfolio";
+const NOT_LINKED_TEXT = "Not linked. Use /link YOURCODE first.";
+const PORTFOLIO_ERROR_TEXT = 'Sorry, something went wrong fetching your portfolio. Please try again later.';
+const GENERIC_ERROR_TEXT = 'Sorry, something went wrong. Please try again later.';
+
+// Number formatting for replies; the Intl formatter is built once, not per call
+const FMT2 = new Intl.NumberFormat(undefined, { minimumFractionDigits: 2, maximumFractionDigits: 2 });
+const sign = (n: number) => (n > 0 ? '+' : n < 0 ? '−' : '');
+const fmt2 = (x: string | number) => FMT2.format(Number(x));
+
+// Link codes are 8 random bytes in hex (see admin.ts generate-link-code)
+const LINK_CODE_RE = /^[0-9a-f]{16}$/i;
+
+// In-memory cache of telegram_user_id -> client_id links (TTL + LRU eviction).
+// Unlinked users are cached too (clientId null, shorter TTL) so repeated
+// commands from them are turned away without touching the database.
+const LINK_TTL_MS = 60_000;
+const UNLINKED_TTL_MS = 10_000;
+const LINK_CACHE_MAX = 1024;
+const linkCache = new Map<number, { clientId: string | null, at: number }>();
+
+async function getLinkedClientId(telegramUserId: number): Promise<string | null> {
+  const hit = linkCache.get(telegramUserId);
+  if (hit && (Date.now() - hit.at) < (hit.clientId ? LINK_TTL_MS : UNLINKED_TTL_MS)) {
+    // refresh recency for LRU ordering
+    linkCache.delete(telegramUserId);
+    linkCache.set(telegramUserId, hit);
+    return hit.clientId;
+  }
+  linkCache.delete(telegramUserId);
+
+  const rows = await preparedQuery<{ client_id: string }>(
+    'link_by_user',
+    SQL_LINK_BY_USER,
+    [telegramUserId]
+  );
+  const clientId = rows[0]?.client_id ?? null;
+
+  linkCache.set(telegramUserId, { clientId, at: Date.now() });
+  if (linkCache.size > LINK_CACHE_MAX) {
+    linkCache.delete(linkCache.keys().next().value!);
+  }
+  return clientId;
+}
+
+function invalidateLink(telegramUserId: number) {
+  linkCache.delete(telegramUserId);
+}
+
+// Client display name + vault mapping, cached per client_id. Clients are
+// seeded out of process, so entries simply expire after PROFILE_TTL_MS.
+type ClientProfile = {
+  clientName: string,
+  vaultRows: { workspace: string; vault_account_id: string }[],
+};
+const PROFILE_TTL_MS = 60_000;
+const profileCache = new Map<string, { profile: ClientProfile, at: number }>();
+
+async function getClientProfile(clientId: string): Promise<ClientProfile> {
+  const hit = profileCache.get(clientId);
+  if (hit && (Date.now() - hit.at) < PROFILE_TTL_MS) return hit.profile;
+
+  const rows = await preparedQuery<{
+    client_name: string;
+    workspace: string | null;
+    vault_account_id: string | null;
+  }>(
+    'client_profile',
+    SQL_CLIENT_PROFILE,
+    [clientId]
+  );
+  const vaultRows: ClientProfile['vaultRows'] = [];
+  for (const r of rows) {
+    if (r.vault_account_id != null) {
+      vaultRows.push({ workspace: r.workspace as string, vault_account_id: r.vault_account_id });
+    }
+  }
+  const profile = { clientName: rows[0]?.client_name || 'Your Account', vaultRows };
+  profileCache.set(clientId, { profile, at: Date.now() });
+  return profile;
+}
+
+// asset_map overrides keyed by upper-cased asset id; the lookup table is
+// built once and reused until it expires, not rebuilt on every /portfolio
+const OVERRIDES_TTL_MS = 60_000;
+let overridesMem: { map: Record<string,string>, at: number } | null = null;
+
+async function getAssetOverrides() {
+  if (overridesMem && (Date.now() - overridesMem.at) < OVERRIDES_TTL_MS) return overridesMem.map;
+  const rows = await preparedQuery<{ asset_id: string; coingecko_id: string }>(
+    'asset_map_all',
+    SQL_ASSET_MAP_ALL
+  );
+  const map = Object.fromEntries(rows.map((r) => [r.asset_id.toUpperCase(), r.coingecko_id]));
+  overridesMem = { map, at: Date.now() };
+  return map;
+}
+
+// Gate for commands that need a linked account: puts client_id in ctx.state.clientId
+const requireLink: MiddlewareFn<Context> = async (ctx, next) => {
+  let clientId: string | null = null;
+  try {
+    if (ctx.from) clientId = await getLinkedClientId(ctx.from.id);
+  } catch (e) {
+    console.error(e);
+    await reply(ctx, GENERIC_ERROR_TEXT);
+    return;
+  }
+  if (!clientId) {
+    await reply(ctx, NOT_LINKED_TEXT);
+    return;
+  }
+  ctx.state.clientId = clientId;
+  return next();
+};
+
 // /start
 bot.start(async (ctx) => {
-  await ctx.reply(
-    "Welcome! If you’re a Solidus client, link your account with:\n/link YOURCODE"
-  );
+  await reply(ctx, WELCOME_TEXT);
 });
 
 // /link CODE
 bot.command('link', async (ctx) => {
-  const parts = ctx.message?.text?.split(' ') ?? [];
-  const code = parts.slice(1).join(' ').trim();
-  if (!code) return ctx.reply("Usage: /link YOURCODE");
+  // Telegraf already slices the text after "/link" (or "/link@bot") into payload
+  const code = ctx.payload.trim();
+  if (!code) return reply(ctx, LINK_USAGE_TEXT);
+  if (!LINK_CODE_RE.test(code)) return reply(ctx, INVALID_CODE_TEXT);
 
-  const crypto = await import('crypto');
-  const hash = crypto.createHash('sha256').update(code).digest('hex');
+  const hash = createHash('sha256').update(code).digest('hex');
 
-  const rows = await query<{client_id:string, expires_at:string, used_at:string}>(
-    "select client_id, expires_at, used_at from link_codes where code_hash=$1",
-    [hash]
+  // Look up, consume, link and audit in one round trip (see SQL_REDEEM_LINK_CODE)
+  const rows = await preparedQuery<{client_id:string, expired:boolean, used_at:string, linked:boolean}>(
+    'redeem_link_code',
+    SQL_REDEEM_LINK_CODE,
+    [hash, ctx.from.id]
   );
   const row = rows[0];
-  if (!row) return ctx.reply("Invalid code.");
-  if (row.used_at) return ctx.reply("This code was already used.");
-  if (new Date(row.expires_at) < new Date()) return ctx.reply("This code expired.");
-
-  await query("insert into user_links(telegram_user_id, client_id) values($1,$2) on conflict (telegram_user_id) do update set client_id=excluded.client_id",
-    [ctx.from.id, row.client_id]);
-  await query("update link_codes set used_at=now() where code_hash=$1", [hash]);
-  await query("insert into audit(telegram_user_id, client_id, action) values($1,$2,'link')", [ctx.from.id, row.client_id]);
+  if (!row) return reply(ctx, INVALID_CODE_TEXT);
+  if (!row.linked) {
+    if (!row.used_at && row.expired) return reply(ctx, CODE_EXPIRED_TEXT);
+    return reply(ctx, CODE_USED_TEXT);
+  }
+  invalidateLink(ctx.from.id);
 
-  await ctx.reply("Linked! You can now use /portfolio");
+  await reply(ctx, LINKED_TEXT);
 });
 
 // /portfolio
-bot.command('portfolio', async (ctx) => {
+bot.command('portfolio', requireLink, async (ctx) => {
   try {
-    // 1) Resolve which client this Telegram user is linked to
-    const links = await query<{ client_id: string }>(
-      "select client_id from user_links where telegram_user_id=$1",
-      [ctx.from.id]
-    );
-    const link = links[0];
-    if (!link) return ctx.reply("Not linked. Use /link YOURCODE first.");
+    // 1) Client this Telegram user is linked to (resolved by requireLink)
+    const clientId: string = ctx.state.clientId;
 
-    // 2) Display name
-    const cinfo = await query<{ client_name: string }>(
-      "select client_name from clients where client_id=$1",
-      [link.client_id]
-    );
-    const clientName = cinfo[0]?.client_name || 'Your Account';
-
-    // 3) All mapped vaults (primary + secondary)
-    const vaultRows = await query<{ workspace: string; vault_account_id: string }>(
-      "select workspace, vault_account_id from client_vaults where client_id=$1",
-      [link.client_id]
-    );
-    // Backward compatibility: if none, fallback to legacy clients table
-    if (!vaultRows.length) {
-      const legacy = await query<{ vault_account_id: string }>(
-        "select vault_account_id from clients where client_id=$1",
-        [link.client_id]
-      );
-      if (legacy[0]?.vault_account_id) {
-        vaultRows.push({ workspace: 'primary', vault_account_id: legacy[0].vault_account_id });
-      }
-    }
+    // 2) Display name + 3) all mapped vaults (primary + secondary)
+    const { clientName, vaultRows } = await getClientProfile(clientId);
     if (!vaultRows.length) {
-      await query(
-        "insert into audit(telegram_user_id, client_id, action) values($1,$2,'portfolio_empty')",
-        [ctx.from.id, link.client_id]
-      );
-      return ctx.reply(`No balances found for your account.`);
+      audit(ctx.from.id, clientId, 'portfolio_empty');
+      return reply(ctx, `No balances found for your account.`);
     }
 
     // 4) Fireblocks clients (primary + secondary)
-    const { makeFireblocksClient } = await import('./fireblocks');
-    const fb1 = makeFireblocksClient('');  // primary
-    const fb2 = makeFireblocksClient('2'); // secondary
+    const fb1 = getFireblocksClient('');  // primary
+    const fb2 = getFireblocksClient('2'); // secondary
 
-    // 5) Fetch assets across all vaults
+    // 5) Fetch assets across all vaults (concurrently); the asset_map
+    //    overrides (step 7) load from the DB while Fireblocks is queried
     type FBAsset = { id: string; total: string };
-    let allAssets: FBAsset[] = [];
-    for (const v of vaultRows) {
-      try {
-        if (v.workspace === 'primary' && fb1.enabled) {
-          const data = await fb1.getVaultAccount(v.vault_account_id);
-          allAssets = allAssets.concat((data.assets || []) as FBAsset[]);
-        } else if (v.workspace === 'secondary' && fb2.enabled) {
-          const data = await fb2.getVaultAccount(v.vault_account_id);
-          allAssets = allAssets.concat((data.assets || []) as FBAsset[]);
+    const [overrides, perVault] = await Promise.all([
+      getAssetOverrides(),
+      Promise.all(vaultRows.map(async (v): Promise<FBAsset[]> => {
+        try {
+          if (v.workspace === 'primary' && fb1.enabled) {
+            const data = await fb1.getVaultAccount(v.vault_account_id);
+            return (data.assets || []) as FBAsset[];
+          } else if (v.workspace === 'secondary' && fb2.enabled) {
+            const data = await fb2.getVaultAccount(v.vault_account_id);
+            return (data.assets || []) as FBAsset[];
+          }
+        } catch (e) {
+          console.error(`Failed to fetch ${v.workspace} vault ${v.vault_account_id}`, e);
         }
-      } catch (e) {
-        console.error(`Failed to fetch ${v.workspace} vault ${v.vault_account_id}`, e);
-      }
-    }
+        return [];
+      })),
+    ]);
+    const allAssets = perVault.flat();
     if (!allAssets.length) {
-      await query(
-        "insert into audit(telegram_user_id, client_id, action) values($1,$2,'portfolio_empty')",
-        [ctx.from.id, link.client_id]
-      );
-      return ctx.reply(`No balances found for your account.`);
+      audit(ctx.from.id, clientId, 'portfolio_empty');
+      return reply(ctx, `No balances found for your account.`);
     }
 
-    // 6) Aggregate by assetId
-    const { default: Decimal } = await import('decimal.js');
-    const totals = new Map<string, any>();
+    // 6) Aggregate by assetId (in vaultRows order, so output order is stable)
+    const totals = new Map<string, Decimal>();
     for (const a of allAssets) {
       const id = (a.id || '').toUpperCase();
       if (!id) continue;
@@ -122,57 +257,39 @@ bot.command('portfolio', async (ctx) => {
       totals.set(id, prev.plus(new Decimal(a.total || '0')));
     }
 
-    // 7) Map assets to CoinGecko IDs (overrides from DB)
-    const overridesRows = await query<{ asset_id: string; coingecko_id: string }>(
-      "select asset_id, coingecko_id from asset_map"
-    );
-    const overrides = Object.fromEntries(overridesRows.map((r) => [r.asset_id.toUpperCase(), r.coingecko_id]));
-    const { mapAssetId } = await import('./mapping');
-
-    const holdings = Array.from(totals.entries())
-      .map(([assetId, qty]) => ({ assetId, qty: qty.toFixed(8), coingeckoId: mapAssetId(assetId, overrides) }))
-      .filter((h) => h.coingeckoId);
+    // 7) Map assets to CoinGecko IDs (overrides from DB, loaded above)
+    // Single pass over the totals; unmapped assets are skipped before formatting
+    const holdings: Holding[] = [];
+    for (const [assetId, qty] of totals) {
+      const coingeckoId = mapAssetId(assetId, overrides);
+      if (coingeckoId) holdings.push({ assetId, qty: qty.toFixed(8), coingeckoId });
+    }
 
     if (!holdings.length) {
-      await query(
-        "insert into audit(telegram_user_id, client_id, action) values($1,$2,'portfolio_empty')",
-        [ctx.from.id, link.client_id]
-      );
-      return ctx.reply(`${clientName}: no balances found.`);
+      audit(ctx.from.id, clientId, 'portfolio_empty');
+      return reply(ctx, `${clientName}: no balances found.`);
     }
 
     // 8) Value and format output
-    const { valueHoldings } = await import('./portfolio');
-    const { getCurrentPrices, getPrice24hAgo } = await import('./prices');
     const { lines, totalUsd, totalPnlUsd } = await valueHoldings(
       holdings,
       getCurrentPrices,
       getPrice24hAgo
     );
 
-    const sign = (n: number) => (n > 0 ? '+' : n < 0 ? '−' : '');
-    const fmt2 = (x: string | number) =>
-      Number(x).toLocaleString(undefined, { minimumFractionDigits: 2, maximumFractionDigits: 2 });
-
-    let msg = `Client: ${clientName}\n`;
-    msg += `\nCurrent Balance:\n`; // label change & no Vault line
+    const out: string[] = [`Client: ${clientName}`, '', 'Current Balance:']; // label change & no Vault line
     for (const l of lines) {
-      const value = fmt2(l.value);
       const pnlNum = Number(l.pnlUsd);
-      const pnlUsd = fmt2(pnlNum);
-      msg += `${l.assetId}  ${l.qty}   $${value}  (24h: ${sign(pnlNum)}$${pnlUsd} / ${l.pnlPct}%)\n`;
+      out.push(`${l.assetId}  ${l.qty}   $${fmt2(l.value)}  (24h: ${sign(pnlNum)}$${fmt2(pnlNum)} / ${l.pnlPct}%)`);
     }
-    const tVal = fmt2(totalUsd);
     const tPnl = Number(totalPnlUsd);
-    msg += `\nTotal: $${tVal}   24h P&L: ${sign(tPnl)}$${fmt2(tPnl)}`;
+    out.push('', `Total: $${fmt2(totalUsd)}   24h P&L: ${sign(tPnl)}$${fmt2(tPnl)}`);
+    const msg = out.join('\n');
 
-    await query("insert into audit(telegram_user_id, client_id, action) values($1,$2,'portfolio')", [
-      ctx.from.id,
-      link.client_id,
-    ]);
-    await ctx.reply(msg);
+    audit(ctx.from.id, clientId, 'portfolio');
+    await reply(ctx, msg);
   } catch (e: any) {
     console.error(e);
-    await ctx.reply('Sorry, something went wrong fetching your portfolio. Please try again later.');
+    await reply(ctx, PORTFOLIO_ERROR_TEXT);
   }
 });
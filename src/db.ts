@@ -3,7 +3,15 @@ import fs from 'fs';
 import path from 'path';
 
 export const pool = new Pool({
-  connectionString: process.env.DATABASE_URL
+  connectionString: process.env.DATABASE_URL,
+  max: Number(process.env.PG_POOL_MAX) || 10,
+  idleTimeoutMillis: 30_000,
+  keepAlive: true,
+  // Per-session settings applied on every pooled connection
+  application_name: 'solidus-telebot',
+  statement_timeout: 10_000,
+  lock_timeout: 5_000,
+  idle_in_transaction_session_timeout: 30_000
 });
 
 export async function query<T = any>(text: string, params?: any[]): Promise<T[]> {
@@ -11,8 +19,63 @@ export async function query<T = any>(text: string, params?: any[]): Promise<T[]>
   return res.rows as T[];
 }
 
+// Named prepared statement: parsed and planned once per pooled connection,
+// then reused. A given name must always be used with the same SQL text.
+export async function preparedQuery<T = any>(name: string, text: string, params?: any[]): Promise<T[]> {
+  const res = await pool.query({ name, text, values: params });
+  return res.rows as T[];
+}
+
 export async function ensureSchema() {
   const sqlPath = path.join(process.cwd(), 'db', '001_init.sql');
   const sql = fs.readFileSync(sqlPath, 'utf8');
-  await pool.query(sql);
+  // The schema script waits on an advisory lock while another worker boots,
+  // and DDL may run long: lift the pool's lock/statement timeouts for it
+  const client = await pool.connect();
+  try {
+    await client.query('set lock_timeout = 0; set statement_timeout = 0');
+    await client.query(sql);
+  } finally {
+    await client.query('reset lock_timeout; reset statement_timeout').catch(() => {});
+    client.release();
+  }
+}
+
+// Bound table growth: drop audit rows past retention and long-expired link codes.
+// Deletes run in bounded batches so each statement stays well inside
+// statement_timeout even when a large backlog has built up.
+const PRUNE_BATCH = 5_000;
+
+async function deleteInBatches(text: string, params: any[] = []) {
+  for (;;) {
+    const res = await pool.query(text, params);
+    if ((res.rowCount ?? 0) < PRUNE_BATCH) return;
+  }
+}
+
+// AUDIT_RETENTION_DAYS: unset or 0 keeps audit rows forever; otherwise a
+// positive whole number of days. Anything else is a startup error, so a typo
+// can never turn into deleting audit history.
+export function auditRetentionDays(): number | null {
+  const raw = (process.env.AUDIT_RETENTION_DAYS ?? '').trim();
+  if (!raw) return null;
+  if (!/^\d+$/.test(raw)) {
+    throw new Error(`AUDIT_RETENTION_DAYS must be a whole number of days (0 = keep forever), got "${raw}"`);
+  }
+  const days = Number.parseInt(raw, 10);
+  return days > 0 ? days : null;
+}
+
+export async function pruneOldRows(auditDays: number | null) {
+  if (auditDays) {
+    await deleteInBatches(
+      `delete from audit where id in (
+         select id from audit where ts < now() - make_interval(days => $1) limit ${PRUNE_BATCH})`,
+      [auditDays]
+    );
+  }
+  await deleteInBatches(
+    `delete from link_codes where code_hash in (
+       select code_hash from link_codes where expires_at < now() - interval '30 days' limit ${PRUNE_BATCH})`
+  );
 }
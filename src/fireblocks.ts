@@ -2,6 +2,16 @@ import axios from 'axios';
 import { SignJWT, importPKCS8 } from 'jose';
 import { v4 as uuidv4 } from 'uuid';
 import { createHash, createPrivateKey } from 'crypto';
+import https from 'https';
+
+// Shared keep-alive agent so every client reuses TCP+TLS connections
+const httpsAgent = new https.Agent({ keepAlive: true, maxSockets: 20, maxFreeSockets: 10 });
+
+// Short-lived cache of vault account responses, keyed by workspace + vault id
+const VAULT_TTL_MS = 30_000;
+const memVault: Record<string,{ data:any, at:number }> = {};
+// Concurrent fetches of the same vault share one in-flight request
+const inflightVault = new Map<string, Promise<any>>();
 
 function normalizeBase(raw?: string) {
   return (raw || 'https://api.fireblocks.io')
@@ -36,8 +46,22 @@ async function importPrivateKey(prefix: '' | '2' = '') {
   return importPKCS8(pem, 'RS256');
 }
 
+// Imported signing key per workspace: PEM parsing + PKCS#8 import happen once,
+// not on every request (a failed import is retried on the next call)
+const keyCache: Partial<Record<'' | '2', ReturnType<typeof importPrivateKey>>> = {};
+
+function getPrivateKey(prefix: '' | '2') {
+  return (keyCache[prefix] ??= importPrivateKey(prefix).catch((e) => {
+    delete keyCache[prefix];
+    throw e;
+  }));
+}
+
+const JWT_HEADER = { alg: 'RS256' } as const;
+
 async function signJwt(
   prefix: '' | '2',
+  apiKey: string | undefined,
   uri: string,
   method: 'GET' | 'POST' | 'DELETE' = 'GET',
   body?: string
@@ -45,18 +69,14 @@ async function signJwt(
   const iat = Math.floor(Date.now() / 1000);
   const exp = iat + 55;
   const nonce = uuidv4();
-
-  const apiKey =
-    (process.env[`FIREBLOCKS${prefix}_API_KEY` as any] as string | undefined) ||
-    (process.env.FIREBLOCKS_API_KEY as string | undefined);
   const payload: any = { uri, nonce, iat, exp, sub: apiKey };
   if (method !== 'GET' && body) {
     const bodyHash = createHash('sha256').update(body, 'utf8').digest('hex');
     payload.bodyHash = bodyHash;
   }
 
-  const key = await importPrivateKey(prefix);
-  return new SignJWT(payload).setProtectedHeader({ alg: 'RS256' }).sign(key);
+  const key = await getPrivateKey(prefix);
+  return new SignJWT(payload).setProtectedHeader(JWT_HEADER).sign(key);
 }
 
 // Factory for a Fireblocks client bound to a workspace
@@ -70,7 +90,7 @@ export function makeFireblocksClient(prefix: '' | '2' = '') {
     (process.env.FIREBLOCKS_API_KEY as string | undefined);
   const pem = resolvePrivateKeyPEM(prefix);
 
-  const http = axios.create({ baseURL: base, timeout: 15000 });
+  const http = axios.create({ baseURL: base, timeout: 15000, httpsAgent });
   const enabled = Boolean(apiKey && pem);
 
   return {
@@ -78,12 +98,24 @@ export function makeFireblocksClient(prefix: '' | '2' = '') {
 
     // GET /v1/vault/accounts/{id}
     async getVaultAccount(vaultAccountId: string) {
-      const path = `/v1/vault/accounts/${vaultAccountId}`;
-      const token = await signJwt(prefix, path, 'GET');
-      const { data } = await http.get(path, {
-        headers: { 'X-API-Key': apiKey, Authorization: `Bearer ${token}` },
-      });
-      return data; // includes .assets[]
+      const key = `${prefix}:${vaultAccountId}`;
+      const hit = memVault[key];
+      if (hit && (Date.now() - hit.at) < VAULT_TTL_MS) return hit.data;
+      const pending = inflightVault.get(key);
+      if (pending) return pending;
+
+      const fetchVault = async () => {
+        const path = `/v1/vault/accounts/${vaultAccountId}`;
+        const token = await signJwt(prefix, apiKey, path, 'GET');
+        const { data } = await http.get(path, {
+          headers: { 'X-API-Key': apiKey, Authorization: `Bearer ${token}` },
+        });
+        memVault[key] = { data, at: Date.now() };
+        return data; // includes .assets[]
+      };
+      const p = fetchVault().finally(() => inflightVault.delete(key));
+      inflightVault.set(key, p);
+      return p;
     },
 
     // GET /v1/vault/accounts_paged?limit=...&next=...
@@ -91,7 +123,7 @@ export function makeFireblocksClient(prefix: '' | '2' = '') {
       const qs = new URLSearchParams({ limit: String(limit) });
       if (next) qs.set('next', next);
       const path = `/v1/vault/accounts_paged?${qs.toString()}`;
-      const token = await signJwt(prefix, path, 'GET');
+      const token = await signJwt(prefix, apiKey, path, 'GET');
       const { data } = await http.get(path, {
         headers: { 'X-API-Key': apiKey, Authorization: `Bearer ${token}` },
       });
@@ -99,3 +131,10 @@ export function makeFireblocksClient(prefix: '' | '2' = '') {
     },
   };
 }
+
+// Process-wide client per workspace, built on first use and reused
+const clients: Partial<Record<'' | '2', ReturnType<typeof makeFireblocksClient>>> = {};
+
+export function getFireblocksClient(prefix: '' | '2' = '') {
+  return (clients[prefix] ??= makeFireblocksClient(prefix));
+}
@@ -1,7 +1,9 @@
 import 'dotenv/config';
 import express from 'express';
 import { bot } from './bot';
-import { ensureSchema } from './db';
+import { auditRetentionDays, ensureSchema, pruneOldRows } from './db';
+import { flushAudit } from './audit';
+import { warmPrices } from './prices';
 
 const app = express();
 
@@ -13,19 +15,32 @@ app.use('/telegram/webhook', (req, res, next) => {
   res.status(403).send('forbidden');
 });
 
-app.use(express.json());
-
-// Telegraf webhook handler
-app.post('/telegram/webhook', (bot.webhookCallback('/telegram/webhook') as any));
+// Telegraf webhook handler (only this route needs a parsed JSON body)
+app.post('/telegram/webhook', express.json(), (bot.webhookCallback('/telegram/webhook') as any));
 
 // Health probe
 app.get('/health', (_req, res) => res.send('ok'));
 
+// Write any buffered audit rows before the process exits
+for (const sig of ['SIGTERM', 'SIGINT'] as const) {
+  process.once(sig, () => {
+    flushAudit().finally(() => process.exit(0));
+  });
+}
+
 const port = Number(process.env.PORT) || 8080;
+// Validated up front: a bad value fails startup instead of pruning
+const auditDays = auditRetentionDays();
 
 (async () => {
   await ensureSchema();
+  // Hourly housekeeping; unref'd so it never keeps the process alive
+  setInterval(() => {
+    pruneOldRows(auditDays).catch((e) => console.error('Pruning failed', e));
+  }, 60 * 60_000).unref();
+
   app.listen(port, () => {
     console.log('listening on', port);
+    void warmPrices();
   });
 })();
@@ -1,11 +1,17 @@
-export const DEFAULT_ASSET_MAP: Record<string,string> = {
+export const DEFAULT_ASSET_MAP: Readonly<Record<string,string>> = Object.freeze({
   BTC: 'bitcoin',
   ETH: 'ethereum',
   USDC: 'usd-coin',
   USDT: 'tether'
-};
+});
 
 export function mapAssetId(assetId: string, overrides?: Record<string,string>) {
   const key = assetId.toUpperCase();
-  return overrides?.[key] ?? DEFAULT_ASSET_MAP[key] ?? null;
+  const exact = overrides?.[key] ?? DEFAULT_ASSET_MAP[key];
+  if (exact) return exact;
+  // Network-suffixed Fireblocks ids (USDT_ERC20, USDC_POLYGON, ...) fall back
+  // to their base symbol; testnet ids (BTC_TEST, ETH_TEST5, ...) never do.
+  const sep = key.indexOf('_');
+  const base = sep > 0 && !key.includes('TEST', sep) ? key.slice(0, sep) : '';
+  return overrides?.[base] ?? DEFAULT_ASSET_MAP[base] ?? null;
 }
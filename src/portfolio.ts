@@ -10,6 +10,13 @@ export async function valueHoldings(
 ): Promise<{ lines:Valued[], totalUsd:string, totalPnlUsd:string }> {
   const ids = Array.from(new Set(items.map(i => i.coingeckoId)));
   const now = await fetchNow(ids);
+  // 24h prices up front (after fetchNow, which may prime their cache), so the
+  // valuation loop below never awaits; zero-quantity holdings are skipped there,
+  // so they get no 24h lookup either
+  const ids24 = Array.from(new Set(items.filter(i => !new Decimal(i.qty || '0').isZero()).map(i => i.coingeckoId)));
+  const ago = await Promise.all(ids24.map(fetch24));
+  const then: Record<string,number> = {};
+  ids24.forEach((id, i) => { then[id] = ago[i]; });
 
   let total = new Decimal(0);
   let totalPnl = new Decimal(0);
@@ -20,10 +27,11 @@ export async function valueHoldings(
     if (qty.isZero()) continue;
 
     const p0 = new Decimal(now[h.coingeckoId] || 0);
-    const p1 = new Decimal(await fetch24(h.coingeckoId));
+    const p1 = new Decimal(then[h.coingeckoId] || 0);
     const val = qty.mul(p0);
-    const pnlUsd = qty.mul(p0.minus(p1));
-    const pnlPct = p1.gt(0) ? p0.minus(p1).div(p1).mul(100) : new Decimal(0);
+    const delta = p0.minus(p1);
+    const pnlUsd = qty.mul(delta);
+    const pnlPct = p1.gt(0) ? delta.div(p1).mul(100) : new Decimal(0);
 
     total = total.plus(val);
     totalPnl = totalPnl.plus(pnlUsd);
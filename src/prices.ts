@@ -1,18 +1,42 @@
 import axios from 'axios';
+import https from 'https';
 
-type PriceNow = Record<string,{ usd:number }>;
-const http = axios.create({ baseURL: 'https://api.coingecko.com/api/v3', timeout: 20000 });
+type PriceNow = Record<string,{ usd:number, usd_24h_change?:number }>;
+const http = axios.create({
+  baseURL: 'https://api.coingecko.com/api/v3',
+  timeout: 20000,
+  httpsAgent: new https.Agent({ keepAlive: true, maxSockets: 10, maxFreeSockets: 5 }),
+});
 
 const memNow: Record<string,{usd:number, at:number}> = {};
 const mem24: Record<string,{usd:number, at:number}> = {};
+// Concurrent 24h lookups for the same coin share one in-flight request
+const inflight24 = new Map<string, Promise<number>>();
+
+// Open a pooled connection ahead of the first real request (best effort)
+export async function warmPrices() {
+  try {
+    await http.get('/ping');
+  } catch (e) {
+    console.error('CoinGecko warm-up failed', e);
+  }
+}
 
 export async function getCurrentPrices(ids: string[]) {
-  const need = ids.filter(id => !(id in memNow) || (Date.now()-memNow[id].at)>60_000);
+  const now = Date.now();
+  const need = ids.filter(id => !(id in memNow) || (now-memNow[id].at)>60_000);
   if (need.length) {
-    const url = `/simple/price?ids=${encodeURIComponent(need.join(','))}&vs_currencies=usd`;
+    // include_24hr_change lets one batch call also prime the 24h-ago cache,
+    // so valueHoldings doesn't need a market_chart request per coin
+    const url = `/simple/price?ids=${encodeURIComponent(need.join(','))}&vs_currencies=usd&include_24hr_change=true`;
     const { data } = await http.get<PriceNow>(url);
+    const at = Date.now();
     for (const id of Object.keys(data)) {
-      memNow[id] = { usd: data[id].usd, at: Date.now() };
+      const { usd, usd_24h_change: chg } = data[id];
+      memNow[id] = { usd, at };
+      if (typeof chg === 'number' && Number.isFinite(chg) && chg > -100) {
+        mem24[id] = { usd: usd / (1 + chg / 100), at };
+      }
     }
   }
   const out: Record<string,number> = {};
@@ -22,14 +46,33 @@ export async function getCurrentPrices(ids: string[]) {
 
 export async function getPrice24hAgo(id: string) {
   if (mem24[id] && (Date.now() - mem24[id].at) < 5*60_000) return mem24[id].usd;
-  // Removed &interval=minute (invalid). Let CG decide granularity for 1 day.
-  const url = `/coins/${encodeURIComponent(id)}/market_chart?vs_currency=usd&days=1`;
+  const pending = inflight24.get(id);
+  if (pending) return pending;
+  const p = fetchPrice24hAgo(id).finally(() => inflight24.delete(id));
+  inflight24.set(id, p);
+  return p;
+}
+
+async function fetchPrice24hAgo(id: string) {
+  // Only a window around 24h ago is requested (25h..23h ago): /market_chart/range
+  // returns a few hourly points to download and parse instead of a full day's
+  // series. The point closest to exactly 24h ago is used.
+  const target = Date.now() - 24 * 3600_000;
+  const from = Math.floor(target / 1000) - 3600;
+  const to = Math.floor(target / 1000) + 3600;
+  const url = `/coins/${encodeURIComponent(id)}/market_chart/range?vs_currency=usd&from=${from}&to=${to}`;
   const { data } = await http.get(url);
   const prices: [number, number][] = data?.prices || [];
-  // Take the earliest point as ~24h ago; if missing, fall back to the last point.
-  const first = prices.length ? prices[0][1] : 0;
-  const last  = prices.length ? prices[prices.length - 1][1] : first;
-  const p24 = typeof first === 'number' && first > 0 ? first : last;
-  mem24[id] = { usd: p24, at: Date.now() };
+  let p24 = 0;
+  let bestGap = Infinity;
+  for (const [ts, usd] of prices) {
+    const gap = Math.abs(ts - target);
+    if (typeof usd === 'number' && usd > 0 && gap < bestGap) {
+      p24 = usd;
+      bestGap = gap;
+    }
+  }
+  // Don't cache a miss: an empty window would otherwise pin a 0 price for 5 minutes
+  if (p24 > 0) mem24[id] = { usd: p24, at: Date.now() };
   return p24;
 }
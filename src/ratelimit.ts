@@ -0,0 +1,28 @@
+// Async token bucket: take() resolves once a token is available.
+// Callers are served in arrival order.
+export function makeTokenBucket(ratePerSec: number, burst = ratePerSec) {
+  let tokens = burst;
+  let last = Date.now();
+  let tail: Promise<void> = Promise.resolve();
+
+  const refill = () => {
+    const now = Date.now();
+    tokens = Math.min(burst, tokens + ((now - last) * ratePerSec) / 1000);
+    last = now;
+  };
+
+  return {
+    take(): Promise<void> {
+      const turn = tail.then(async () => {
+        refill();
+        if (tokens < 1) {
+          await new Promise((r) => setTimeout(r, ((1 - tokens) * 1000) / ratePerSec));
+          refill();
+        }
+        tokens -= 1;
+      });
+      tail = turn;
+      return turn;
+    },
+  };
+}
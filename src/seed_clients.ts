@@ -8,14 +8,23 @@ async function main() {
   const content = fs.readFileSync(csvPath, 'utf8').trim();
   const rows = content.split(/\r?\n/).map(l => l.split(',').map(s => s.trim()));
   // Expect header: client_id,client_name,vault_account_id
-  if (!/^client_id,client_name,vault_account_id$/i.test(rows[0].join(','))) {
+  if (rows[0].join(',').toLowerCase() !== 'client_id,client_name,vault_account_id') {
     throw new Error('CSV header must be: client_id,client_name,vault_account_id');
   }
+  // Last row wins for a repeated client_id (one upsert can't touch a row twice)
+  const byId = new Map<string, [string, string]>();
   for (const [client_id, client_name, vault_account_id] of rows.slice(1)) {
-    await query("insert into clients(client_id,client_name,vault_account_id) values($1,$2,$3) on conflict (client_id) do update set client_name=excluded.client_name, vault_account_id=excluded.vault_account_id",
-      [client_id, client_name, vault_account_id]);
-    console.log('Upserted', client_id);
+    byId.set(client_id, [client_name, vault_account_id]);
   }
+  const ids = Array.from(byId.keys());
+  const names = ids.map(id => byId.get(id)![0]);
+  const vaults = ids.map(id => byId.get(id)![1]);
+
+  // All rows in one multi-row upsert (a single statement, so a single commit)
+  const upserted = await query<{ client_id: string }>(
+    "insert into clients(client_id,client_name,vault_account_id) select * from unnest($1::text[], $2::text[], $3::text[]) on conflict (client_id) do update set client_name=excluded.client_name, vault_account_id=excluded.vault_account_id returning client_id",
+    [ids, names, vaults]);
+  for (const r of upserted) console.log('Upserted', r.client_id);
   console.log('Done.');
 }
 main().catch(e => { console.error(e); process.exit(1); });